@@ -22,13 +22,20 @@ import os
 import sys
 import configparser
 import time
-import datetime
+import threading
+import selectors
+import queue
 import numpy as np
 import predict
 from asciimatics.screen import ManagedScreen, Screen, KeyboardEvent, MouseEvent
 import socket
 import serial
 import argparse
+import struct
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # Gpredict configuration file and directories
 GPREDICT_CONFIG_DIR = os.path.expanduser("~/.config/Gpredict")
@@ -40,16 +47,66 @@ GPREDICT_TRSP_DIR = os.path.join(GPREDICT_CONFIG_DIR, "trsp")
 # Main loop update interval
 UI_INTERVAL_MS = 25
 CALC_INTERVAL_MS = 300
+# Satellite calculations are done less often when doppler changes slowly
+CALC_INTERVAL_MAX_MS = 2000
+# Always use the minimum calculation interval close to the horizon
+HORIZON_MARGIN_DEG = 5
+# Doppler correction is applied when the frequency changes by this amount,
+# immediately above the flush threshold, otherwise after the flush interval
+DOPPLER_THRESHOLD_HZ = 10
+DOPPLER_FLUSH_HZ = 50
+DOPPLER_FLUSH_INTERVAL_MS = 1000
+# Rig frequency polling interval
+RIG_INTERVAL_MS = 300
+# Number of formatted frequency strings kept for display
+FREQ_STR_CACHE_SIZE = 64
+
+# Display strings
+UTC_FORMAT = "UTC %H:%M:%S %Y-%m-%d"
+# Transponder passband bar with marker at every position, below and above
+TRSP_BAR_LEN = 13
+TRSP_BAR = [x*"ᐧ" + "|" + (TRSP_BAR_LEN-1-x)*"ᐧ" for x in range(TRSP_BAR_LEN)]
+TRSP_BAR_BELOW = "<<<" + (TRSP_BAR_LEN-3)*"ᐧ"
+TRSP_BAR_ABOVE = (TRSP_BAR_LEN-3)*"ᐧ" + ">>>"
+
+# BCD lookup tables, byte for every value 0..99 and value for every byte
+# (None for invalid BCD digits)
+BCD_ENC = bytes((i // 10) << 4 | i % 10 for i in range(100))
+BCD_DEC = [(b >> 4)*10 + (b & 0x0F) if b >> 4 < 10 and b & 0x0F < 10 else None
+           for b in range(256)]
+
+# Linux serial ioctls to enable low latency mode on USB serial adapters
+TIOCGSERIAL = 0x541E
+TIOCSSERIAL = 0x541F
+ASYNC_LOW_LATENCY = 0x2000
 
 
 def grphex(ba):
-    s = ba.hex()
-    t = iter(s)
-    return " ".join(a+b for a,b in zip(t,t))
+    return ba.hex(" ")
 
 def printhex(ba):
     print(grphex(ba))
 
+def parse_ini(path):
+    # Minimal parser for the simple Gpredict .sat and .trsp files, much
+    # faster than ConfigParser. Returns a dict of sections with a dict of
+    # keys and values each.
+    with open(path, "rb") as f:
+        data = f.read()
+    sections = {}
+    section = None
+    for line in data.split(b"\n"):
+        line = line.strip()
+        if not line or line[0] in b"#;":
+            continue
+        if line[0] == ord("[") and line[-1] == ord("]"):
+            section = sections.setdefault(line[1:-1].decode("utf-8"), {})
+        elif section is not None:
+            key, sep, val = line.partition(b"=")
+            if sep:
+                section[key.strip().decode("utf-8")] = val.strip().decode("utf-8")
+    return sections
+
 
 class Satellite():
     def __init__(self, id, name, tle, qth, trsp={}):
@@ -58,15 +115,41 @@ class Satellite():
         self.tle = tle
         self.trsp = self._build_trsp_list(trsp)
         self.qth = qth
+        # Highest transponder frequency, used to estimate doppler drift
+        self._f_max = max(
+            [t["f_dwn"] for t in self.trsp] + [t["f_up"] for t in self.trsp],
+            default=100e6
+        )
+        self.calc_interval_ms = CALC_INTERVAL_MS
+        self._t_obs = None
+        self._doppler100 = 0
         self.update()
 
     def update(self):
+        t = time.monotonic()
         new_obs = predict.observe(self.tle, self.qth)
         self.obs = new_obs
+        # Cache doppler values derived from this observation, they only
+        # change when predict is called again
+        doppler100_old = self._doppler100
+        self._doppler100 = self.obs["doppler"]
+        self._doppler_r = 1.0 + self._doppler100 / 100e6
+        # Adapt recalculation interval to the doppler rate. Double it as long
+        # as the doppler shift would change by less than a tenth of the
+        # threshold during the next interval.
+        if self._t_obs is not None and t > self._t_obs:
+            rate = abs(self._doppler100 - doppler100_old) / (t - self._t_obs)
+            interval = min(2 * self.calc_interval_ms, CALC_INTERVAL_MAX_MS)
+            df = rate * self._f_max / 100e6 * interval / 1000
+            if (df < DOPPLER_THRESHOLD_HZ / 10 and
+                    abs(self.obs["elevation"]) > HORIZON_MARGIN_DEG):
+                self.calc_interval_ms = interval
+            else:
+                self.calc_interval_ms = CALC_INTERVAL_MS
+        self._t_obs = t
 
     def doppler_at_f(self, f, tx=False):
-        doppler100 = self.obs["doppler"]
-        doppler = f/100e6 * doppler100
+        doppler = f/100e6 * self._doppler100
         if not tx:
             return doppler
         else:
@@ -90,8 +173,7 @@ class Satellite():
 
     @property
     def doppler_r(self):
-        doppler100 = self.obs["doppler"]
-        return 1 + (doppler100 / 100e6)
+        return self._doppler_r
 
     def _build_trsp_list(self, transponder):
         tlist = []
@@ -120,6 +202,21 @@ class Satellite():
                 else:
                     f_up_delta = 0
             mode = trsp["MODE"]
+            # Display colour by transponder type
+            name = trsp_name.lower()
+            if "lin" in name:
+                color = Screen.COLOUR_GREEN
+            elif "beac" in name:
+                color = Screen.COLOUR_BLUE
+            elif "fm" in name:
+                color = Screen.COLOUR_YELLOW
+            else:
+                color = Screen.COLOUR_WHITE
+            # Preformatted frequencies for display
+            f_dwn_str = f"{f_dwn:,}".replace(",", " ")
+            f_up_str = "-"
+            if f_up > 0:
+                f_up_str = f"{f_up:,}".replace(",", " ")
             tlist += [
                 {
                     "name": trsp_name,
@@ -128,7 +225,10 @@ class Satellite():
                     "f_dwn": f_dwn,
                     "f_up": f_up,
                     "f_dwn_delta": f_dwn_delta,
-                    "f_up_delta": f_up_delta
+                    "f_up_delta": f_up_delta,
+                    "color": color,
+                    "f_dwn_str": f_dwn_str,
+                    "f_up_str": f_up_str
                 }
             ]
         return tlist
@@ -137,24 +237,52 @@ class Satellite():
 
 
 class Icom821H():
+    PRE = b"\xFE\xFE\x4C\xE0"
+    PRE_RSP = b"\xFE\xFE\xE0\x4C"
+    EOM = b"\xFD"
+
     def __init__(self, serport, baud):
         self.ser = serial.Serial(serport, baud, timeout=0.1)
+        self._set_low_latency()
 
-    def get_freq(self):
-        rsp = self.cmd(b"\x03", 11)
-        data = rsp[11:16].hex()
+    def _set_low_latency(self):
+        # Reduce the FTDI latency timer from 16ms to 1ms. Only supported on
+        # Linux, silently ignored elsewhere or if the driver refuses.
+        if fcntl is None or not sys.platform.startswith("linux"):
+            return
         try:
-            f = int(data[8]+data[9]+data[6]+data[7]+data[4]+
-                data[5]+data[2]+data[3]+data[0]+data[1])
-        except:
-            f = 0
-        return f
+            fd = self.ser.fileno()
+            buf = bytearray(fcntl.ioctl(fd, TIOCGSERIAL, bytes(0x48)))
+            # flags field of struct serial_struct
+            flags, = struct.unpack_from("i", buf, 16)
+            struct.pack_into("i", buf, 16, flags | ASYNC_LOW_LATENCY)
+            fcntl.ioctl(fd, TIOCSSERIAL, bytes(buf))
+        except (OSError, AttributeError):
+            pass
+
+    @staticmethod
+    def decode_freq(rsp):
+        # Decode BCD frequency (least significant byte first) from a read
+        # frequency response. Returns 0 for an incomplete or invalid
+        # response.
+        if len(rsp) < 11 or rsp[4] != 0x03:
+            return 0
+        d = [BCD_DEC[b] for b in rsp[5:10]]
+        if None in d:
+            return 0
+        return d[4]*100_000_000 + d[3]*1_000_000 + d[2]*10_000 + d[1]*100 + d[0]
+
+    @staticmethod
+    def encode_freq(f):
+        # Encode frequency as 5 BCD bytes, least significant byte first
+        return bytes(BCD_ENC[(f // 100**i) % 100] for i in range(5))
+
+    def get_freq(self):
+        rsp = self.cmd(b"\x03")
+        return self.decode_freq(rsp)
 
     def set_freq(self, f):
-        f = f"{f:010d}"
-        f = f[8]+f[9]+f[6]+f[7]+f[4]+f[5]+f[2]+f[3]+f[0]+f[1]
-        f = bytearray.fromhex(f)
-        rsp = self.cmd(b"\x05" + f)
+        rsp = self.cmd(b"\x05" + self.encode_freq(f))
 
     def main_access(self):
         self.cmd(b"\x07\xd0")
@@ -174,7 +302,8 @@ class Icom821H():
     def set_simplex(self):
         self.cmd(b"\x0f\x10")
 
-    def set_mode(self, mode):
+    @staticmethod
+    def encode_mode(mode):
         md = b""
         if "LSB" in mode:
             md = b"\x00"
@@ -184,19 +313,55 @@ class Icom821H():
             md = b"\x03\x01"
         elif "FM" in mode:
             md = b"\x05"
-        else:
+        return md
+
+    def set_mode(self, mode):
+        md = self.encode_mode(mode)
+        if not md:
             return
         self.cmd(b"\x06" + md)
 
-    def cmd(self, cnscdata, nrsp=6):
-        PRE = b"\xFE\xFE\x4C\xE0"
-        EOM = b"\xFD"
-        msg = PRE + cnscdata + EOM
-        nrcv = nrsp + len(msg)
-        self.ser.reset_input_buffer()
-        self.ser.reset_output_buffer()
-        self.ser.write(msg)
-        return self.ser.read(nrcv)
+    def cmd(self, cnscdata):
+        return self.cmd_batch([cnscdata])[0]
+
+    def cmd_batch(self, frames):
+        # Send several commands with a single write and return the response
+        # of every command (b"" if it did not arrive).
+        msgs = [self.PRE + c + self.EOM for c in frames]
+        self.ser.write(b"".join(msgs))
+        return self._read_rsps(msgs)
+
+    def _read_rsps(self, msgs):
+        # CI-V is a single wire bus, so the echoes of all commands written
+        # at once arrive first and the radio answers afterwards, one
+        # response per command in order. Frames are read up to EOM instead
+        # of flushing the buffers. Responses are only taken once the echoes
+        # of all commands have arrived in order, anything before are stale
+        # frames from earlier commands.
+        rsps = []
+        n_echo = 0
+        while len(rsps) < len(msgs):
+            frame = self.ser.read_until(self.EOM)
+            if not frame.endswith(self.EOM):
+                # Timeout
+                break
+            # Drop garbage and extra preamble bytes in front of the frame
+            i = frame.find(b"\xFE\xFE")
+            if i < 0:
+                continue
+            frame = frame[i:]
+            while frame.startswith(b"\xFE\xFE\xFE"):
+                frame = frame[1:]
+            if n_echo < len(msgs):
+                if frame == msgs[n_echo]:
+                    n_echo += 1
+                elif frame == msgs[0]:
+                    n_echo = 1
+                else:
+                    n_echo = 0
+            elif frame.startswith(self.PRE_RSP):
+                rsps += [ frame ]
+        return rsps + [b""] * (len(msgs) - len(rsps))
 
 
 class Rig():
@@ -219,9 +384,54 @@ class Rig():
 
         self._f_main = 0
         self._f_sub = 0
+        # Serial I/O is done by the rig thread. Frequency and mode changes
+        # are queued as CI-V command batches, frequencies are polled
+        # continuously and published under the lock.
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        # Incremented on every frequency change to discard polls which
+        # were started before the change was sent to the radio
+        self._gen = 0
+        # Serial error which stopped the rig thread, raised by the UI loop
+        self.error = None
+        # Readable when new frequencies have been read from the radio
+        self.notify, self._notify_w = socket.socketpair()
+        self.notify.setblocking(False)
+        self._notify_w.setblocking(False)
 
         self.read()
 
+        if self.icom:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        t_poll = time.monotonic()
+        try:
+            while True:
+                timeout = max(0, t_poll - time.monotonic())
+                try:
+                    frames = self._queue.get(timeout=timeout)
+                    self.icom.cmd_batch(frames)
+                except queue.Empty:
+                    self.read()
+                    t_poll = time.monotonic() + RIG_INTERVAL_MS / 1000
+        except (serial.SerialException, OSError) as e:
+            # E.g. USB adapter unplugged, hand over to the UI loop
+            self.error = e
+            self._notify()
+
+    @staticmethod
+    def _band(f):
+        # 2m and 70cm band are distinguished by the 100MHz digit
+        return int(f) // 100_000_000
+
+    @property
+    def freqs(self):
+        # Consistent (main, sub) pair, the rig thread may update both
+        with self._lock:
+            return (self._f_main, self._f_sub)
+
     @property
     def f_main(self):
         return self._f_main
@@ -232,50 +442,89 @@ class Rig():
 
     @f_main.setter
     def f_main(self, value):
-        if self.icom:
-            self.icom.main_access()
-            if str(value)[0] != str(self._f_main)[0]:
-                self.icom.xchg_main_sub()
-                self._f_sub = self._f_main
-            self.icom.set_freq(int(value))
-            self.icom.sub_access()
-        self._f_main = value
+        self.set_freqs(f_main=value)
 
     @f_sub.setter
     def f_sub(self, value):
-        if self.icom:
-            self.icom.sub_access()
-            if str(value)[0] != str(self._f_sub)[0]:
-                self.icom.xchg_main_sub()
-                self._f_main = self._f_sub
-            self.icom.set_freq(int(value))
-        self._f_sub = value
+        self.set_freqs(f_sub=value)
+
+    def set_freqs(self, f_main=None, f_sub=None):
+        # Set main and/or sub frequency with a single command batch
+        if f_main is None and f_sub is None:
+            return
+        with self._lock:
+            frames = []
+            if f_main is not None:
+                # main access, [exchange main/sub], set freq, sub access
+                frames += [b"\x07\xd0"]
+                if self._band(f_main) != self._band(self._f_main):
+                    frames += [b"\x07\xb0"]
+                    self._f_sub = self._f_main
+                frames += [b"\x05" + Icom821H.encode_freq(int(f_main))]
+                frames += [b"\x07\xd1"]
+                self._f_main = f_main
+            if f_sub is not None:
+                # [sub access], [exchange main/sub], set freq
+                if f_main is None:
+                    frames += [b"\x07\xd1"]
+                if self._band(f_sub) != self._band(self._f_sub):
+                    frames += [b"\x07\xb0"]
+                    self._f_main = self._f_sub
+                frames += [b"\x05" + Icom821H.encode_freq(int(f_sub))]
+                self._f_sub = f_sub
+            if self.icom and frames and not self.error:
+                self._queue.put(frames)
+            self._gen += 1
 
     def set_mode_main(self, mode):
-        if self.icom:
-            self.icom.main_access()
-            self.icom.set_mode(mode)
-            self.icom.sub_access()
+        md = Icom821H.encode_mode(mode)
+        if self.icom and md and not self.error:
+            self._queue.put([b"\x07\xd0", b"\x06" + md, b"\x07\xd1"])
 
     def set_mode_sub(self, mode):
-        if self.icom:
-            self.icom.sub_access()
-            self.icom.set_mode(mode)
+        md = Icom821H.encode_mode(mode)
+        if self.icom and md and not self.error:
+            self._queue.put([b"\x07\xd1", b"\x06" + md])
 
     def read(self):
         # Read frequencie from radio but keep fractional parts to avoid
         # rounding errors if frequencies have not changed
         if self.icom:
-            self.icom.main_access()
-            f = self.icom.get_freq()
-            if f > 0:
-                if int(self._f_main) != f:
-                    self._f_main = f
-            self.icom.sub_access()
-            f = self.icom.get_freq()
-            if f > 0:
-                if int(self._f_sub) != f:
-                    self._f_sub = f
+            with self._lock:
+                gen = self._gen
+            # main access, read freq, sub access, read freq
+            rsps = self.icom.cmd_batch(
+                [b"\x07\xd0", b"\x03", b"\x07\xd1", b"\x03"]
+            )
+            # Drop the whole poll unless all commands were answered with
+            # the expected ACK/frequency pattern, late responses to earlier
+            # commands would otherwise be taken for the wrong VFO
+            if [r[4:5] for r in rsps] != [b"\xFB", b"\x03", b"\xFB", b"\x03"]:
+                return
+            f_main = self.icom.decode_freq(rsps[1])
+            f_sub = self.icom.decode_freq(rsps[3])
+            with self._lock:
+                # Frequency was set while reading, result is outdated
+                if gen != self._gen:
+                    return
+                changed = False
+                if f_main > 0:
+                    if int(self._f_main) != f_main:
+                        self._f_main = f_main
+                        changed = True
+                if f_sub > 0:
+                    if int(self._f_sub) != f_sub:
+                        self._f_sub = f_sub
+                        changed = True
+            if changed:
+                self._notify()
+
+    def _notify(self):
+        # Wake up the UI loop, a pending notification is sufficient
+        try:
+            self._notify_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
 
 
 class Application():
@@ -289,6 +538,17 @@ class Application():
         self.is_engaged = False
         # Indicates rig ctrl activity
         self.txrig = False
+        # Forces satellite calculations on the next loop
+        self._recalc = True
+        # Formatted frequency strings
+        self._freq_str = {}
+        # QTH is the same for all satellites
+        lat = self.current_sat.qth[0]
+        lon = self.current_sat.qth[1]
+        alt = self.current_sat.qth[2]
+        latdesig = "N" if lat > 0 else "S"
+        longdesig = "W" if lon > 0 else "E" # this is predict convention
+        self._qth_str = f"QTH: {abs(lat):06.3f}°{latdesig} {abs(lon):07.3f}°{longdesig} {alt:.0f}m"
         # Rig
         self.rig = Rig(port, baud)
         # Start main loop and pass screen object
@@ -303,6 +563,7 @@ class Application():
         self.current_sat = self.satellites[(idx+1)%n]
         self.current_trsp = 0
         self.is_engaged = False
+        self._recalc = True
 
     def _previous_sat(self):
         idx = self.satellites.index(self.current_sat)
@@ -310,6 +571,7 @@ class Application():
         self.current_sat = self.satellites[(idx-1)%n]
         self.current_trsp = 0
         self.is_engaged = False
+        self._recalc = True
 
     def _next_trsp(self):
         self.current_trsp = (self.current_trsp + 1) % len(self.current_sat.trsp)
@@ -319,90 +581,261 @@ class Application():
 
     def _toggle_engage(self):
         self.is_engaged = not self.is_engaged
+        self._recalc = True
 
     def format_freq(self, freq, sign=False):
         freq = int(freq)
-        if sign:
-            return ("+" if freq>0 else "") + f"{freq:,}".replace(",", " ")
+        # Dial frequencies mostly stay constant between ticks, so keep
+        # recently formatted values
+        key = (freq, sign)
+        s = self._freq_str.get(key)
+        if s is None:
+            s = f"{freq:_}".replace("_", " ")
+            if sign and freq > 0:
+                s = "+" + s
+            if len(self._freq_str) >= FREQ_STR_CACHE_SIZE:
+                self._freq_str.clear()
+            self._freq_str[key] = s
+        return s
+
+    def _trsp_bar(self, f, f_mid, f_delta):
+        # Position of f within the transponder passband
+        if not f_delta:
+            return ""
+        f_lo = f_mid - f_delta/2
+        f_hi = f_mid + f_delta/2
+        if f < f_lo:
+            return TRSP_BAR_BELOW
+        elif f > f_hi:
+            return TRSP_BAR_ABOVE
+        x = round((f - f_lo) / (f_hi - f_lo) * (TRSP_BAR_LEN-1))
+        return TRSP_BAR[x]
+
+    def _cached_print(self, screen, key, text, x, y,
+            col=Screen.COLOUR_WHITE, att=Screen.A_NORMAL):
+        # Print only if the text or its appearance changed since the last
+        # call with the same key. A previous text is erased first, an empty
+        # text just erases it.
+        new = (text, x, y, col, att)
+        old = self._last.get(key)
+        if old == new:
+            return
+        if old and not (old[1:3] == (x, y) and len(text) >= len(old[0])):
+            screen.print_at(len(old[0])*" ", old[1], old[2],
+                Screen.COLOUR_WHITE, Screen.A_NORMAL, Screen.COLOUR_BLACK)
+        if text:
+            screen.print_at(text, x, y, col, att)
+            self._last[key] = new
         else:
-            return f"{freq:,}".replace(",", " ")
+            self._last.pop(key, None)
+
+    def _draw_static(self, screen):
+        # Draw labels and other content that does not change
+        screen.clear_buffer(Screen.COLOUR_WHITE, Screen.A_NORMAL, Screen.COLOUR_BLACK)
+        self._last = {}
+        ny, nx = screen.dimensions
+        # Print title line
+        screen.print_at("satrig v1.0", 0, 0)
+        screen.move(0, 1)
+        screen.draw(11, 1, thin=True)
+        screen.print_at(self._qth_str, 20, 0)
+        # Satellite
+        SAT_LINE = 2
+        screen.print_at("SAT:", 0, SAT_LINE)
+        # Rig
+        RIG_LINE = 4
+        #screen.print_at("RIG:", 0, RIG_LINE)
+        col = Screen.COLOUR_WHITE
+        att = Screen.A_NORMAL
+        screen.print_at("   VFO RX [Hz]", 45, RIG_LINE, col, att)
+        screen.print_at("   VFO TX [Hz]", 61, RIG_LINE, col, att)
+        screen.print_at("     Dial", 34, RIG_LINE+1, col, att)
+        screen.print_at("  Doppler", 34, RIG_LINE+2, col, att)
+        screen.print_at("Satellite", 34, RIG_LINE+3, col, att)
+        # Transponder header
+        TRSP_LINE = 9
+        col = Screen.COLOUR_WHITE
+        att = Screen.A_BOLD
+        screen.print_at("Nr  Transponder", 0, TRSP_LINE, col, att)
+        screen.print_at("Mode", 36, TRSP_LINE, col, att)
+        screen.print_at("I", 42, TRSP_LINE, col, att)
+        screen.print_at(" Downlink [Hz]", 45, TRSP_LINE, col, att)
+        screen.print_at("   Uplink [Hz]", 61, TRSP_LINE, col, att)
+        # Print help line at bottom
+        screen.print_at("🡄 🡆 : sat", 0, ny-1)
+        screen.print_at("🡅 🡇 : transponder", 13, ny-1)
+        #screen.print_at("e: engage   t: track   x: set freq   ctrl-c: quit", 31, ny-1)
+        screen.print_at("    e: engage      x: set freq       ctrl-c: quit", 31, ny-1)
+
+    def _wait(self, sel, t_until):
+        # Wait until t_until, return early on keyboard input or when the rig
+        # thread has read new frequencies
+        timeout = max(0, t_until - time.monotonic())
+        for key, events in sel.select(timeout):
+            if key.fileobj is self.rig.notify:
+                try:
+                    self.rig.notify.recv(64)
+                except BlockingIOError:
+                    pass
 
     def _loop(self, screen):
-        CALC_INTERVAL_START = CALC_INTERVAL_MS / UI_INTERVAL_MS
-        calc_interval = 0
+        # Screen state for partial redraws
+        self._dimensions = None
+        self._last = {}
+        self._utc_t = None
+        # Wait for keyboard input and new rig frequencies between ticks
+        sel = selectors.DefaultSelector()
+        sel.register(self.rig.notify, selectors.EVENT_READ)
+        # select() only supports sockets on Windows. Other stdin which can't
+        # be polled (e.g. /dev/null) just waits for the next tick as well.
+        if sys.platform != "win32":
+            try:
+                sel.register(sys.stdin, selectors.EVENT_READ)
+            except (OSError, ValueError):
+                pass
+        t_tick = time.monotonic()
+        t_calc = 0
         self.f_main_old = self.rig.f_main
         self.f_sub_old = self.rig.f_sub
-        self.r_old = self.current_sat.doppler_r
+        # Doppler ratio the (main, sub) dial frequencies were last set for
+        self.r_old = np.full(2, self.current_sat.doppler_r)
+        self.t_flush = 0
         while True:
-            # Decrement calculation interval counter and do an actual
-            # predict recalculation when the counter reaches zero.
-            calc_interval -= 1
-            if calc_interval <= 0:
-                # Read rig
-                self.rig.read()
+            # Rig thread has stopped on a serial error
+            if self.rig.error:
+                raise self.rig.error
+            # Do an actual predict recalculation when the calculation
+            # interval has passed
+            t = time.monotonic()
+            if t >= t_calc or self._recalc:
+                self._recalc = False
                 # Do satellite calculations
                 try:
                     self.current_sat.update()
                 except AttributeError:
                     pass
-                calc_interval = CALC_INTERVAL_START
+                # Satellite decides on the interval unless we are engaged
+                if self.is_engaged:
+                    t_calc = t + CALC_INTERVAL_MS / 1000
+                else:
+                    t_calc = t + self.current_sat.calc_interval_ms / 1000
                 # Do rig control
                 if self.is_engaged:
                     # Adjust to current doppler shift if change is above threshold
-                    f_th = 10
+                    f_th = DOPPLER_THRESHOLD_HZ
                     sat = self.current_sat
+                    # Work on (main, sub) vectors from a single snapshot of
+                    # the rig frequencies, the rig thread may update them
+                    f = np.array(self.rig.freqs)
+                    f_old = np.array([self.f_main_old, self.f_sub_old])
                     # Check if frequencies have changes. if so do not adjust
                     # doppler, as we are assuming operator is adjusting dials
-                    f_main_changed = bool(self.rig.f_main != self.f_main_old)
-                    f_sub_changed = bool(self.rig.f_sub != self.f_sub_old)
-                    # Calculate doppler shifted frequencies
-                    f_main_new = sat.doppler_fobs_from_fsat(
-                        sat.doppler_fsat_from_fobs(
-                            self.rig.f_main, r=self.r_old, tx=True
-                        ), tx=True
-                    )
-                    f_sub_new = sat.doppler_fobs_from_fsat(
-                        sat.doppler_fsat_from_fobs(
-                            self.rig.f_sub, r=self.r_old,
+                    f_changed = f != f_old
+                    # Calculate doppler shifted frequencies. Going from the
+                    # observed frequency to the satellite frequency with the
+                    # old doppler ratio and back with the new one reduces to
+                    # a single factor (inverted for tx on main).
+                    r_new = sat.doppler_r
+                    # A retuned dial already matches the current doppler, so
+                    # drift accumulated for that VFO must not be applied again
+                    self.r_old = np.where(f_changed, r_new, self.r_old)
+                    f_new = f * np.array([self.r_old[0] / r_new, r_new / self.r_old[1]])
+                    # Small corrections accumulate until the flush threshold
+                    # or the flush interval is reached, then both frequencies
+                    # are sent together
+                    df = np.max(np.abs(f - f_new))
+                    t = time.monotonic()
+                    dt_flush = (t - self.t_flush) * 1000
+                    if (df >= DOPPLER_FLUSH_HZ or
+                            (df >= f_th and dt_flush >= DOPPLER_FLUSH_INTERVAL_MS)):
+                        self.r_old = np.full(2, r_new)
+                        self.rig.set_freqs(
+                            None if f_changed[0] else float(f_new[0]),
+                            None if f_changed[1] else float(f_new[1])
                         )
-                    )
-                    # Apply only when diff frequency above threshold
-                    df_main = abs(self.rig.f_main - f_main_new)
-                    df_sub = abs(self.rig.f_sub - f_sub_new)
-                    if (df_main >= f_th) or (df_sub >= f_th):
-                        self.r_old = sat.doppler_r
-                        if not f_main_changed:
-                            self.rig.f_main = f_main_new
-                        if not f_sub_changed:
-                            self.rig.f_sub = f_sub_new
+                        self.t_flush = t
                         self.txrig = True
                 else:
-                    self.r_old = self.current_sat.doppler_r
+                    self.r_old = np.full(2, self.current_sat.doppler_r)
 
                 # Save rig frequencies for next loop
                 self.f_main_old = self.rig.f_main
                 self.f_sub_old = self.rig.f_sub
 
 
-            # Sleep for a short while
-            time.sleep(UI_INTERVAL_MS / 1000)
-            #screen.clear()
-            screen.clear_buffer(Screen.COLOUR_WHITE, Screen.A_NORMAL, Screen.COLOUR_BLACK)
+            # Sleep until the next tick unless woken up earlier
+            self._wait(sel, t_tick)
+            t = time.monotonic()
+            if t >= t_tick:
+                t_tick = max(t_tick + UI_INTERVAL_MS / 1000, t)
+            # Handle all pending events before drawing so the screen already
+            # shows their result
+            while True:
+                evt = screen.get_event()
+                if evt is None:
+                    break
+                if isinstance(evt, KeyboardEvent):
+                    # Right arrow = next satellite
+                    if evt.key_code == Screen.KEY_RIGHT:
+                        self._next_sat()
+                    # Left arrow = previous satellite
+                    elif evt.key_code == Screen.KEY_LEFT:
+                        self._previous_sat()
+                    # Down arrow = next transponder
+                    elif evt.key_code == Screen.KEY_DOWN:
+                        self._next_trsp()
+                    # Up arrow = previous transponder
+                    elif evt.key_code == Screen.KEY_UP:
+                        self._previous_trsp()
+                    # Engage
+                    elif evt.key_code == ord('e'):
+                        self._toggle_engage()
+                    # Set freq
+                    elif evt.key_code == ord("x"):
+                        trsp = self.current_sat.trsp[self.current_trsp]
+                        f = trsp["f_dwn"]
+                        fobs = self.current_sat.doppler_fobs_from_fsat(f)
+                        self.rig.f_sub = fobs
+                        f = trsp["f_up"]
+                        if f > 0:
+                            fobs = self.current_sat.doppler_fobs_from_fsat(f, tx=True)
+                            self.rig.f_main = fobs
+                        if trsp["mode"] in ["USB", "LSB", "CW", "FM"]:
+                            self.rig.set_mode_sub(trsp["mode"])
+                        else:
+                            self.rig.set_mode_sub("USB")
+                        if trsp["inverting"]:
+                            if trsp["mode"] == "USB":
+                                self.rig.set_mode_main("LSB")
+                            elif trsp["mode"] == "LSB":
+                                self.rig.set_mode_main("USB")
+                        else:
+                            self.rig.set_mode_main(trsp["mode"])
+                    elif evt.key_code == ord("r"):
+                        self.rig.f_main = 145000000
+                        self.rig.f_sub = 435000000
+                    elif evt.key_code == ord("p"):
+                        self.rig.f_main += 1000
+                    elif evt.key_code == ord("m"):
+                        self.rig.f_main -= 1000
+                    elif evt.key_code == ord("o"):
+                        self.rig.f_sub += 1000
+                    elif evt.key_code == ord("n"):
+                        self.rig.f_sub -= 1000
+
             sat = self.current_sat
             obs = sat.obs
-            ny, nx = screen.dimensions
-            # Print title line
-            screen.print_at("satrig v1.0", 0, 0)
-            screen.move(0, 1)
-            screen.draw(11, 1, thin=True)
-            lat = sat.qth[0]
-            lon = sat.qth[1]
-            alt = sat.qth[2]
-            latdesig = "N" if lat > 0 else "S"
-            longdesig = "W" if lon > 0 else "E" # this is predict convention
-            screen.print_at(f"QTH: {abs(lat):06.3f}°{latdesig} {abs(lon):07.3f}°{longdesig} {alt:.0f}m", 20, 0)
-            utc = datetime.datetime.now().astimezone(datetime.timezone.utc)
-            screen.print_at(f"{utc.strftime('UTC %H:%M:%S %Y-%m-%d')}", nx-24, 0)
+            nx = screen.dimensions[1]
+            # Static parts are only drawn once or after a resize
+            if screen.dimensions != self._dimensions:
+                self._dimensions = screen.dimensions
+                self._draw_static(screen)
+            # Time is displayed in seconds, only format it once per second
+            t = int(time.time())
+            if t != self._utc_t:
+                self._utc_t = t
+                self._utc_str = time.strftime(UTC_FORMAT, time.gmtime(t))
+            self._cached_print(screen, "utc", self._utc_str, nx-24, 0)
             # Print satellite information
             SAT_LINE = 2
             az = obs["azimuth"]
@@ -412,178 +845,94 @@ class Application():
                 col = Screen.COLOUR_GREEN
             elif el > 0:
                 col = Screen.COLOUR_YELLOW
-            screen.move(5, SAT_LINE)
-            screen.draw(35, SAT_LINE, colour=col)
-            screen.print_at("SAT:", 0, SAT_LINE)
-            screen.print_at(sat.name, 6, SAT_LINE, col, Screen.A_REVERSE)
-            screen.print_at(f"Az: {az:5.1f}°", 38, SAT_LINE, col)
-            screen.print_at(f"El: {el:+4.1f}°", 50, SAT_LINE, col)
-            screen.print_at(f"Δf@100Mhz: {obs['doppler']:+5.0f}Hz", 62, SAT_LINE, col)
+            # Line and name are drawn over each other, redraw both together
+            if self._last.get("sat") != (sat.name, col):
+                if "sat" in self._last:
+                    screen.print_at(len(self._last["sat"][0])*" ", 6, SAT_LINE,
+                        Screen.COLOUR_WHITE, Screen.A_NORMAL, Screen.COLOUR_BLACK)
+                screen.move(5, SAT_LINE)
+                screen.draw(35, SAT_LINE, colour=col)
+                screen.print_at(sat.name, 6, SAT_LINE, col, Screen.A_REVERSE)
+                self._last["sat"] = (sat.name, col)
+            self._cached_print(screen, "az", f"Az: {az:5.1f}°", 38, SAT_LINE, col)
+            self._cached_print(screen, "el", f"El: {el:+4.1f}°", 50, SAT_LINE, col)
+            self._cached_print(screen, "doppler",
+                f"Δf@100Mhz: {obs['doppler']:+5.0f}Hz", 62, SAT_LINE, col)
             # Rig
             RIG_LINE = 4
-            #screen.print_at("RIG:", 0, RIG_LINE)
             col = Screen.COLOUR_RED
             att = Screen.A_NORMAL
             if self.is_engaged:
                 att = Screen.A_REVERSE
-            screen.print_at(" ENGAGED ", 5, RIG_LINE+1, col, att)
-            att = Screen.A_NORMAL
+            self._cached_print(screen, "engaged", " ENGAGED ", 5, RIG_LINE+1, col, att)
             if self.txrig:
                 self.txrig = False
-                screen.print_at("  RADIO  ",
+                self._cached_print(screen, "radio", "  RADIO  ",
                     5, RIG_LINE+3, Screen.COLOUR_RED, Screen.A_REVERSE)
-            col = Screen.COLOUR_WHITE
-            att = Screen.A_NORMAL
-            screen.print_at("   VFO RX [Hz]", 45, RIG_LINE, col, att)
-            screen.print_at("   VFO TX [Hz]", 61, RIG_LINE, col, att)
-            screen.print_at("     Dial", 34, RIG_LINE+1, col, att)
-            screen.print_at("  Doppler", 34, RIG_LINE+2, col, att)
-            screen.print_at("Satellite", 34, RIG_LINE+3, col, att)
+            else:
+                self._cached_print(screen, "radio", "", 5, RIG_LINE+3)
             f_main = self.rig.f_main
             f_sub = self.rig.f_sub
-            f_main_sat = self.current_sat.doppler_fsat_from_fobs(f_main, tx=True)
-            f_sub_sat = self.current_sat.doppler_fsat_from_fobs(f_sub)
-            doppler_main = self.current_sat.doppler_at_f(f_main_sat, tx=True)
-            doppler_sub = self.current_sat.doppler_at_f(f_sub_sat)
+            # Inlined doppler_fsat_from_fobs() and doppler_at_f(), main is tx
+            r = sat.doppler_r
+            f_main_sat = f_main * r
+            f_sub_sat = f_sub / r
+            doppler_main = -f_main_sat * (r - 1)
+            doppler_sub = f_sub_sat * (r - 1)
 
             col = Screen.COLOUR_GREEN
             att = Screen.A_REVERSE
-            screen.print_at("{:>14}".format(self.format_freq(f_sub)), 45, RIG_LINE+1, col, att)
+            self._cached_print(screen, "f_sub",
+                "{:>14}".format(self.format_freq(f_sub)), 45, RIG_LINE+1, col, att)
             col = Screen.COLOUR_YELLOW
-            screen.print_at("{:>14}".format(self.format_freq(f_main)), 61, RIG_LINE+1, col, att)
+            self._cached_print(screen, "f_main",
+                "{:>14}".format(self.format_freq(f_main)), 61, RIG_LINE+1, col, att)
             col = Screen.COLOUR_MAGENTA
             att = Screen.A_NORMAL
-            screen.print_at("{:>14}".format(self.format_freq(doppler_sub, True)), 45, RIG_LINE+2, col, att)
-            screen.print_at("{:>14}".format(self.format_freq(doppler_main, True)), 61, RIG_LINE+2, col, att)
+            self._cached_print(screen, "doppler_sub",
+                "{:>14}".format(self.format_freq(doppler_sub, True)), 45, RIG_LINE+2, col, att)
+            self._cached_print(screen, "doppler_main",
+                "{:>14}".format(self.format_freq(doppler_main, True)), 61, RIG_LINE+2, col, att)
             att = Screen.A_BOLD
             col = Screen.COLOUR_GREEN
-            screen.print_at("{:>14}".format(self.format_freq(f_sub_sat)), 45, RIG_LINE+3, col, att)
+            self._cached_print(screen, "f_sub_sat",
+                "{:>14}".format(self.format_freq(f_sub_sat)), 45, RIG_LINE+3, col, att)
             col = Screen.COLOUR_YELLOW
-            screen.print_at("{:>14}".format(self.format_freq(f_main_sat)), 61, RIG_LINE+3, col, att)
+            self._cached_print(screen, "f_main_sat",
+                "{:>14}".format(self.format_freq(f_main_sat)), 61, RIG_LINE+3, col, att)
 
             # Print transponder frequency info
             trsp = self.current_sat.trsp[self.current_trsp]
             col = Screen.COLOUR_GREEN
             att = Screen.A_NORMAL
-            if trsp["f_dwn_delta"]:
-                n = 13
-                f_lo = trsp["f_dwn"] - trsp["f_dwn_delta"]/2
-                f_hi = trsp["f_dwn"] + trsp["f_dwn_delta"]/2
-                screen.print_at(n*"ᐧ", 46, RIG_LINE+4, col, att)
-                if f_sub_sat < f_lo:
-                    screen.print_at("<<<", 46, RIG_LINE+4, col, att)
-                elif f_sub_sat > f_hi:
-                    screen.print_at(">>>", 56, RIG_LINE+4, col, att)
-                else:
-                    x = round((f_sub_sat - f_lo) / (f_hi - f_lo) * (n-1))
-                    screen.print_at("|", 46+x, RIG_LINE+4, col, att)
+            bar = self._trsp_bar(f_sub_sat, trsp["f_dwn"], trsp["f_dwn_delta"])
+            self._cached_print(screen, "bar_dwn", bar, 46, RIG_LINE+4, col, att)
             col = Screen.COLOUR_YELLOW
             att = Screen.A_NORMAL
-            if trsp["f_up_delta"]:
-                n = 13
-                f_lo = trsp["f_up"] - trsp["f_up_delta"]/2
-                f_hi = trsp["f_up"] + trsp["f_up_delta"]/2
-                screen.print_at(n*"ᐧ", 61, RIG_LINE+4, col, att)
-                if f_main_sat < f_lo:
-                    screen.print_at("<<<", 61, RIG_LINE+4, col, att)
-                elif f_main_sat > f_hi:
-                    screen.print_at(">>>", 71, RIG_LINE+4, col, att)
-                else:
-                    x = round((f_main_sat - f_lo) / (f_hi - f_lo) * (n-1))
-                    screen.print_at("|", 61+x, RIG_LINE+4, col, att)
-
-
+            bar = self._trsp_bar(f_main_sat, trsp["f_up"], trsp["f_up_delta"])
+            self._cached_print(screen, "bar_up", bar, 61, RIG_LINE+4, col, att)
 
             # Print transponder info
             TRSP_LINE = 9
-            col = Screen.COLOUR_WHITE
-            att = Screen.A_BOLD
-            screen.print_at("Nr  Transponder", 0, TRSP_LINE, col, att)
-            screen.print_at("Mode", 36, TRSP_LINE, col, att)
-            screen.print_at("I", 42, TRSP_LINE, col, att)
-            screen.print_at(" Downlink [Hz]", 45, TRSP_LINE, col, att)
-            screen.print_at("   Uplink [Hz]", 61, TRSP_LINE, col, att)
-
             for i, trsp in enumerate(sat.trsp):
                 if i == self.current_trsp:
                     att = Screen.A_REVERSE
                 else:
                     att = Screen.A_NORMAL
-                if "lin" in trsp["name"].lower():
-                    col = Screen.COLOUR_GREEN
-                elif "beac" in trsp["name"].lower():
-                    col = Screen.COLOUR_BLUE
-                elif "fm" in trsp["name"].lower():
-                    col = Screen.COLOUR_YELLOW
-                else:
-                    col = Screen.COLOUR_WHITE
-                f_dwn = f"{trsp['f_dwn']:,}".replace(",", " ")
-                f_up = "-"
-                if trsp["f_up"] > 0:
-                    f_up = f"{trsp['f_up']:,}".replace(",", " ")
-                screen.print_at(nx*" ", 0, TRSP_LINE+i+1, col, att)
-                screen.print_at(f"{i:2d}  {trsp['name'][:30]}", 0, TRSP_LINE+i+1, col, att)
-                screen.print_at(f"{trsp['mode']:>4}", 36, TRSP_LINE+i+1, col, att)
-                screen.print_at("I" if trsp["inverting"] else "-", 42, TRSP_LINE+i+1, col, att)
-                screen.print_at(f"{f_dwn:>14}", 45, TRSP_LINE+i+1, col, att)
-                screen.print_at(f"{f_up:>14}", 61, TRSP_LINE+i+1, col, att)
-
-            # Print help line at bottom
-            screen.print_at("🡄 🡆 : sat", 0, ny-1)
-            screen.print_at("🡅 🡇 : transponder", 13, ny-1)
-            #screen.print_at("e: engage   t: track   x: set freq   ctrl-c: quit", 31, ny-1)
-            screen.print_at("    e: engage      x: set freq       ctrl-c: quit", 31, ny-1)
-
-            # Handle events
-            evt = screen.get_event()
-            if isinstance(evt, KeyboardEvent):
-                # Right arrow = next satellite
-                if evt.key_code == Screen.KEY_RIGHT:
-                    self._next_sat()
-                # Left arrow = previous satellite
-                elif evt.key_code == Screen.KEY_LEFT:
-                    self._previous_sat()
-                # Down arrow = next transponder
-                elif evt.key_code == Screen.KEY_DOWN:
-                    self._next_trsp()
-                # Up arrow = previous transponder
-                elif evt.key_code == Screen.KEY_UP:
-                    self._previous_trsp()
-                # Engage
-                elif evt.key_code == ord('e'):
-                    self._toggle_engage()
-                # Set freq
-                elif evt.key_code == ord("x"):
-                    trsp = self.current_sat.trsp[self.current_trsp]
-                    f = trsp["f_dwn"]
-                    fobs = self.current_sat.doppler_fobs_from_fsat(f)
-                    self.rig.f_sub = fobs
-                    f = trsp["f_up"]
-                    if f > 0:
-                        fobs = self.current_sat.doppler_fobs_from_fsat(f, tx=True)
-                        self.rig.f_main = fobs
-                    if trsp["mode"] in ["USB", "LSB", "CW", "FM"]:
-                        self.rig.set_mode_sub(trsp["mode"])
-                    else:
-                        self.rig.set_mode_sub("USB")
-                    if trsp["inverting"]:
-                        if trsp["mode"] == "USB":
-                            self.rig.set_mode_main("LSB")
-                        elif trsp["mode"] == "LSB":
-                            self.rig.set_mode_main("USB")
-                    else:
-                        self.rig.set_mode_main(trsp["mode"])
-                elif evt.key_code == ord("r"):
-                    self.rig.f_main = 145000000
-                    self.rig.f_sub = 435000000
-                elif evt.key_code == ord("p"):
-                    self.rig.f_main += 1000
-                elif evt.key_code == ord("m"):
-                    self.rig.f_main -= 1000
-                elif evt.key_code == ord("o"):
-                    self.rig.f_sub += 1000
-                elif evt.key_code == ord("n"):
-                    self.rig.f_sub -= 1000
+                col = trsp["color"]
+                f_dwn = trsp["f_dwn_str"]
+                f_up = trsp["f_up_str"]
+                inv = "I" if trsp["inverting"] else "-"
+                line = (f"{i:2d}  {trsp['name'][:30]:30}  {trsp['mode']:>4}  "
+                        f"{inv}  {f_dwn:>14}  {f_up:>14}")
+                self._cached_print(screen, ("trsp", i), f"{line:{nx}}",
+                    0, TRSP_LINE+i+1, col, att)
+            # Clear rows left over from a satellite with more transponders
+            i = len(sat.trsp)
+            while ("trsp", i) in self._last:
+                self._cached_print(screen, ("trsp", i), "", 0, TRSP_LINE+i+1)
+                i += 1
+
             # Refresh screen
             screen.refresh()
 
@@ -628,28 +977,24 @@ def main(args):
         satellite = None
         # Get basic satellite information
         try:
-            with open(satdata_fname) as f:
-                sat_config = configparser.ConfigParser()
-                sat_config.read_file(f)
-                version = sat_config["Satellite"]["VERSION"]
-                if version != "1.1":
-                    print(f"Unknown data format version {version}")
-                    sys.exit()
-                name = sat_config["Satellite"]["NAME"]
-                tle1 = sat_config["Satellite"]["TLE1"]
-                tle2 = sat_config["Satellite"]["TLE2"]
-                tle = "\n".join(['0 ' + name, tle1, tle2])
+            sat_config = parse_ini(satdata_fname)
+            version = sat_config["Satellite"]["VERSION"]
+            if version != "1.1":
+                print(f"Unknown data format version {version}")
+                sys.exit()
+            name = sat_config["Satellite"]["NAME"]
+            tle1 = sat_config["Satellite"]["TLE1"]
+            tle2 = sat_config["Satellite"]["TLE2"]
+            tle = "\n".join(['0 ' + name, tle1, tle2])
         except EnvironmentError:
             print(f"Can't open '{satdata_fname}")
             sys.exit()
         # Get transponder information
         trsp_fname = os.path.join(GPREDICT_TRSP_DIR, satid + ".trsp")
         try:
-            with open(trsp_fname) as f:
-                trsp_config = configparser.ConfigParser()
-                trsp_config.read_file(f)
+            trsp_config = parse_ini(trsp_fname)
         except EnvironmentError:
-            print(f"Can´t open '{trsp_config}")
+            print(f"Can´t open '{trsp_fname}")
             trsp_config = {}
         # Finally create Satellite object and add it to the list
         satellite = Satellite(satid, name=name, tle=tle, qth=qth, trsp=trsp_config)